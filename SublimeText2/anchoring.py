@@ -0,0 +1,173 @@
+import bisect
+import hashlib
+
+# How many characters at the start of a resource are used to find candidate
+# positions for it, how many characters on either side of it are folded into
+# its context hash, and how many candidates are checked before giving up.
+c_head_width = 32
+c_context_width = 16
+c_max_candidates = 64
+
+c_hash_base = 257
+c_hash_mod = 1000000007
+
+
+def rolling_hash(text):
+    value = 0
+    for char in text:
+        value = (value * c_hash_base + ord(char)) % c_hash_mod
+
+    return value
+
+
+def digest(text):
+    return hashlib.md5(text.encode('utf-8')).hexdigest()
+
+
+def context_digest(text, start, end):
+    before = text[max(0, start - c_context_width):start]
+    after = text[end:end + c_context_width]
+    return digest(before + u"\0" + after)
+
+
+"""
+Describes the text between "start" and "end" (character offsets into "text")
+well enough to find it again after the surrounding file has been edited.
+"""
+def fingerprint(text, start, end):
+    region_text = text[start:end]
+
+    return {
+        'length': len(region_text),
+        'head': region_text[:c_head_width],
+        'digest': digest(region_text),
+        'context': context_digest(text, start, end)
+    }
+
+
+def is_anchored(text, start, end, _fingerprint):
+    return digest(text[start:end]) == _fingerprint['digest']
+
+
+# Returns the offset of every window of c_head_width characters in "codes"
+# (the ord() of each character of the text) whose hash is one of "heads".
+def find_heads(codes, heads):
+    width = c_head_width
+    if width > len(codes):
+        return []
+
+    base = c_hash_base
+    mod = c_hash_mod
+    top_power = pow(base, width - 1, mod)
+
+    value = 0
+    for code in codes[:width]:
+        value = (value * base + code) % mod
+
+    offsets = []
+    if value in heads:
+        offsets.append(0)
+
+    # plain locals and zip instead of indexing keep this loop cheap enough
+    # to run over the whole file on load
+    offset = 1
+    for outgoing, incoming in zip(codes, codes[width:]):
+        value = ((value - outgoing * top_power) * base + incoming) % mod
+        if value in heads:
+            offsets.append(offset)
+        offset += 1
+
+    return offsets
+
+
+# Yields the sorted "offsets" nearest to "old_start" first.
+def offsets_outward(offsets, old_start):
+    after = bisect.bisect_left(offsets, old_start)
+    before = after - 1
+    while before >= 0 or after < len(offsets):
+        if after == len(offsets) or \
+                (before >= 0 and old_start - offsets[before] <= offsets[after] - old_start):
+            yield offsets[before]
+            before -= 1
+        else:
+            yield offsets[after]
+            after += 1
+
+
+# Yields every occurrence of "needle" in "text", nearest to "old_start" first.
+def occurrences_outward(text, needle, old_start):
+    after = text.find(needle, old_start)
+    before = text.rfind(needle, 0, old_start - 1 + len(needle)) if old_start > 0 else -1
+    while before >= 0 or after >= 0:
+        if after < 0 or (before >= 0 and old_start - before <= after - old_start):
+            yield before
+            before = text.rfind(needle, 0, before - 1 + len(needle)) if before > 0 else -1
+        else:
+            yield after
+            after = text.find(needle, after + 1)
+
+
+# Goes through "offsets" nearest first and returns the (start, end) of the
+# first match with the same surrounding context. Without one, a match is
+# only trusted when it is the only one, and every candidate has been seen.
+def pick_match(text, _fingerprint, offsets, is_short):
+    length = _fingerprint['length']
+    head = _fingerprint['head']
+
+    match = None
+    is_ambiguous = False
+    for checked, offset in enumerate(offsets):
+        if checked == c_max_candidates:
+            return None
+
+        end = offset + length
+        if not is_short and (text[offset:offset + c_head_width] != head or
+                not is_anchored(text, offset, end, _fingerprint)):
+            continue
+
+        if context_digest(text, offset, end) == _fingerprint['context']:
+            return (offset, end)
+
+        if match is None:
+            match = (offset, end)
+        else:
+            is_ambiguous = True
+
+    return None if is_ambiguous else match
+
+
+"""
+Finds the new location of each drifted resource in "text".
+
+"anchors" is a list of (old start, fingerprint) pairs. Returns a list of the
+same length holding the new (start, end) of each resource, or None for any
+resource whose text can't be found again or isn't found in a single place.
+Resources at least c_head_width characters long are looked up with one
+rolling-hash pass over the text shared by all of them; shorter ones are
+their own head and are searched for directly.
+"""
+def reanchor(text, anchors):
+    heads = {}
+    for index, (_, _fingerprint) in enumerate(anchors):
+        if _fingerprint['length'] >= c_head_width:
+            heads.setdefault(rolling_hash(_fingerprint['head']), []).append(index)
+
+    candidates = [[] for _ in anchors]
+    if len(heads) > 0:
+        for offset in find_heads(map(ord, text), heads):
+            for index in heads[rolling_hash(text[offset:offset + c_head_width])]:
+                candidates[index].append(offset)
+
+    retval = []
+    for (old_start, _fingerprint), offsets in zip(anchors, candidates):
+        length = _fingerprint['length']
+        if length == 0:
+            retval.append(None)
+        elif length < c_head_width:
+            retval.append(pick_match(text, _fingerprint,
+                occurrences_outward(text, _fingerprint['head'], old_start), True))
+        else:
+            retval.append(pick_match(text, _fingerprint,
+                offsets_outward(offsets, old_start), False))
+
+    return retval
@@ -1,4 +1,5 @@
 import itertools
+import multiprocessing
 
 # Like Result from Rust or Elm; should probably break this out into its own module
 class Result:
@@ -122,31 +123,156 @@ def slice_from_hook(hook, num_extra_lines):
                 return err("The end column: " + split_end_row_and_col[1] + ", must be a number!")
         else:
             end_col = 0
+    else:
+        # a hook without an end is just the start point
+        end_row = start_row
+        end_col = start_col
 
     return file_slice(file_name, start_row, start_col, end_row, end_col, num_extra_lines)
 
 
-def slice_to_strings(slice_plus_extra):
-    retval = []
-    i = 0
+def slice_line(slice_plus_extra, i, line, max_line_width):
+    line = line.rstrip()
+    if max_line_width is not None and len(line) > max_line_width:
+        # the width is counted in characters, so that a multi-byte character
+        # is never split; bytes that aren't UTF-8 show up as replacements
+        characters = line.decode('utf-8', 'replace')
+        if len(characters) > max_line_width:
+            cut = len(characters) - max_line_width
+            line = characters[:max_line_width].encode('utf-8')
+            line += " ... (" + str(cut) + " more characters)"
+
+    file_row = slice_plus_extra.line_start + i
+    if i >= slice_plus_extra.slice_start_row and i <= slice_plus_extra.slice_end_row:
+        return ("{0:5}".format(file_row + 1) + ": " + line).rstrip()
+    else:
+        return ("{0:5}".format(file_row + 1) + "  " + line).rstrip()
 
-    for line in slice_plus_extra.region:
-        file_row = slice_plus_extra.line_start + i
-        if i >= slice_plus_extra.slice_start_row and i <= slice_plus_extra.slice_end_row:
-            retval.append(("{0:5}".format(file_row + 1) + ": " + line).rstrip())
-        else:
-            retval.append(("{0:5}".format(file_row + 1) + "  " + line).rstrip())
-        i += 1
 
-    return retval
+# Renders the lines of a slice lazily. Once "max_lines" lines or "max_bytes"
+# bytes have been produced, the rest of the slice is only counted and a single
+# "... N more lines" marker is yielded in its place. Lines longer than
+# "max_line_width" are cut short. A budget of None means no limit.
+def iter_slice_lines(slice_plus_extra, max_lines=None, max_bytes=None, max_line_width=None):
+    num_bytes = 0
+    region = iter(slice_plus_extra.region)
+
+    for i, line in enumerate(region):
+        rendered = slice_line(slice_plus_extra, i, line, max_line_width)
+        num_bytes += len(rendered) + 1
 
+        if (max_lines is not None and i >= max_lines) or \
+           (max_bytes is not None and num_bytes > max_bytes):
+            num_left = 1 + sum(1 for _ in region)
+            yield "      ... " + str(num_left) + " more lines"
+            return
+
+        yield rendered
+
+
+def slice_to_strings(slice_plus_extra):
+    return list(iter_slice_lines(slice_plus_extra))
 
-def slice_to_string(slice_plus_extra):
+
+def slice_to_string(slice_plus_extra, max_lines=None, max_bytes=None, max_line_width=None):
     from cStringIO import StringIO
     output = StringIO()
 
-    for line in slice_to_strings(slice_plus_extra):
+    for line in iter_slice_lines(slice_plus_extra, max_lines, max_bytes, max_line_width):
         output.write(line + "\n")
 
     return output.getvalue()
 
+
+# Index of the length (in characters) of every line of a file, read in one go.
+# Row n of the file can hold columns 0 through line_lengths[n] inclusive.
+def line_lengths(file_name):
+    try:
+        with open(file_name, 'rb') as file_to_index:
+            content = file_to_index.read()
+    except IOError:
+        return err("Could not open file: " + file_name)
+
+    content = content.decode('utf-8', 'replace')
+    return ok([len(line.rstrip('\r')) for line in content.split('\n')])
+
+
+def is_point_in_range(lengths, point):
+    return (point['row'] >= 0 and point['row'] < len(lengths) and
+        point['col'] >= 0 and point['col'] <= lengths[point['row']])
+
+
+def scan_resource(lengths, resource):
+    if not is_point_in_range(lengths, resource['start']) or \
+       not is_point_in_range(lengths, resource['end']):
+        return 'out-of-range'
+
+    start = (resource['start']['row'], resource['start']['col'])
+    end = (resource['end']['row'], resource['end']['col'])
+    if end <= start:
+        return 'empty'
+
+    return None
+
+
+# Takes a single tuple so that it can be handed to multiprocessing.Pool.map
+def scan_file(folder_file_and_resources):
+    folder, file_name, resources = folder_file_and_resources
+
+    lengths = line_lengths(folder + '/' + file_name)
+    problems = []
+    for resource in resources:
+        if lengths.is_ok():
+            kind = scan_resource(lengths.ok, resource)
+        else:
+            kind = 'missing-file'
+
+        if kind is not None:
+            problems.append({
+                'kind': kind,
+                'resource': {
+                    'file': file_name,
+                    'start': resource['start'],
+                    'end': resource['end'],
+                    'requirementUid': resource['requirementUid']
+                }
+            })
+
+    return problems
+
+
+# Validates every resource in a {file name: [resources]} map against the files
+# under "folder". Each file is read once, and files are spread across a
+# process pool. Pass processes=1 to scan in the current process.
+def scan_resources(folder, files_to_resources, processes=None):
+    jobs = [(folder, file_name, resources)
+        for file_name, resources in files_to_resources.iteritems()]
+
+    if processes == 1 or len(jobs) <= 1:
+        results = map(scan_file, jobs)
+    else:
+        if processes is None:
+            processes = multiprocessing.cpu_count()
+
+        pool = multiprocessing.Pool(processes)
+        try:
+            # a few chunks per worker keeps them busy without paying
+            # the pickling overhead once per file
+            chunk_size = max(1, len(jobs) // (processes * 4))
+            results = pool.map(scan_file, jobs, chunk_size)
+        finally:
+            pool.close()
+            pool.join()
+
+    return [problem for problems in results for problem in problems]
+
+
+if __name__ == '__main__':
+    import sys
+    from speccore import cli
+
+    if len(sys.argv) != 2:
+        print "usage: python fileslices.py <project folder>"
+        sys.exit(2)
+
+    sys.exit(cli.main(['--project', sys.argv[1], '--json', 'scan']))
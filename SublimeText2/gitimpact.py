@@ -0,0 +1,180 @@
+import fileslices
+import re
+import subprocess
+
+c_hunk_header = re.compile(r'^@@ -\d+(?:,\d+)? \+(\d+)(?:,(\d+))? @@')
+c_whole_file = (0, float('inf'))
+# the id git gives a tree with nothing in it
+c_empty_tree = '4b825dc642cb6eb9a060e54bf8d69288fbee4904'
+
+
+# Merges the (first row, last row) ranges of a file into sorted, disjoint
+# ranges, so that their last rows are sorted as well.
+def merged_rows(rows):
+    merged = []
+    for first_row, last_row in sorted(rows):
+        if len(merged) > 0 and first_row <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], last_row))
+        else:
+            merged.append((first_row, last_row))
+
+    return merged
+
+
+# Returns the resources of a file that overlap any of "rows" with one sweep
+# over both in row order: a range that ends before a resource starts ends
+# before every later resource starts too, so it is never looked at again.
+def overlapping_resources(rows, resources):
+    rows = merged_rows(rows)
+
+    retval = []
+    index = 0
+    for resource in sorted(resources, key=lambda resource: resource['start']['row']):
+        while index < len(rows) and rows[index][1] < resource['start']['row']:
+            index += 1
+        if index == len(rows):
+            break
+
+        if rows[index][0] <= resource['end']['row']:
+            retval.append(resource)
+
+    return retval
+
+
+# Turns a file name from a diff header into the name used in resources.json.
+# git ends a name that holds a space with a tab, and wraps a name with special
+# characters in quotes with C-style escapes; the "a/" or "b/" prefix is inside
+# the quotes.
+def diff_path(path, prefix):
+    if path.endswith('\t'):
+        path = path[:-1]
+    if len(path) > 1 and path.startswith('"') and path.endswith('"'):
+        path = path[1:-1].decode('string_escape')
+
+    if not path.startswith(prefix):
+        return None
+
+    return path[len(prefix):].decode('utf-8', 'replace')
+
+
+# "diff --git a/<name> b/<name>" can only be split reliably when both names are
+# the same; a renamed file is named again by its "rename to" line.
+def diff_git_path(line):
+    paths = line[len('diff --git '):]
+    if paths.endswith('"'):
+        start = paths.rfind(' "')
+        return diff_path(paths[start + 1:], 'b/') if start >= 0 else None
+
+    length = (len(paths) - len('a/ b/')) // 2
+    if length <= 0 or paths[len('a/'):len('a/') + length] != paths[-length:]:
+        return None
+
+    return diff_path(paths[-length - len('b/'):], 'b/')
+
+
+# Turns the output of "git diff -U0" into {file name: [(first row, last row)]}
+# with 0-based rows on the new side of the diff. A hunk that only deletes lines
+# touches the rows on either side of the deletion, and a deleted file is
+# touched everywhere.
+def changed_rows_by_file(diff_output):
+    files_to_rows = {}
+    old_file_name = None
+    file_name = None
+
+    # the ---/+++ lines only name the files between a "diff --git" line and
+    # the first hunk; inside a hunk they are removed or added lines
+    in_header = False
+    for line in diff_output.splitlines():
+        if line.startswith('diff --git '):
+            in_header = True
+            old_file_name = None
+            file_name = diff_git_path(line)
+        elif in_header and line.startswith('rename to '):
+            file_name = diff_path(line[len('rename to '):], '')
+        elif in_header and line.startswith('--- '):
+            old_file_name = diff_path(line[len('--- '):], 'a/')
+        elif in_header and line.startswith('+++ '):
+            file_name = diff_path(line[len('+++ '):], 'b/')
+            if file_name is None and old_file_name is not None:
+                # the file was deleted
+                files_to_rows[old_file_name] = [c_whole_file]
+        elif line.startswith('@@ '):
+            in_header = False
+            match = c_hunk_header.match(line)
+            if match is None or file_name is None:
+                continue
+
+            start = int(match.group(1))
+            count = 1 if match.group(2) is None else int(match.group(2))
+            rows = files_to_rows.setdefault(file_name, [])
+            if count == 0:
+                rows.append((max(0, start - 1), start))
+            else:
+                rows.append((start - 1, start + count - 2))
+
+    return files_to_rows
+
+
+def run_git(folder, args):
+    try:
+        proc = subprocess.Popen(['git', '-c', 'core.quotepath=off'] + args, cwd=folder,
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        output, error_output = proc.communicate()
+    except OSError:
+        return fileslices.err("Could not run git. Is it installed and on your PATH?")
+
+    if proc.returncode != 0:
+        return fileslices.err("git " + args[0] + " failed: " + error_output.strip())
+
+    return fileslices.ok(output)
+
+
+# Without a commit range the working tree, staged changes included, is
+# compared against HEAD, or against nothing at all before the first commit.
+def git_diff(folder, commit_range=None):
+    if not commit_range:
+        head = run_git(folder, ['rev-parse', '--verify', '--quiet', 'HEAD'])
+        commit_range = 'HEAD' if head.is_ok() else c_empty_tree
+
+    return run_git(folder,
+        ['diff', '-U0', '--no-color', '--no-ext-diff', '--relative', commit_range])
+
+
+# Returns {requirement uid: [resources touched by the change]}, where each
+# resource also carries the name of its file under 'file'.
+def impacted_resources(files_to_rows, files_to_resources):
+    uids_to_resources = {}
+
+    for file_name, rows in files_to_rows.iteritems():
+        if file_name not in files_to_resources or len(rows) == 0:
+            continue
+
+        for resource in overlapping_resources(rows, files_to_resources[file_name]):
+            uids_to_resources.setdefault(resource['requirementUid'], []).append({
+                'file': file_name,
+                'start': resource['start'],
+                'end': resource['end'],
+                'requirementUid': resource['requirementUid']
+            })
+
+    return uids_to_resources
+
+
+def impact_of_diff(folder, files_to_resources, commit_range=None):
+    diff_output = git_diff(folder, commit_range)
+    if not diff_output.is_ok():
+        return diff_output
+
+    return fileslices.ok(impacted_resources(
+        changed_rows_by_file(diff_output.ok), files_to_resources))
+
+
+if __name__ == '__main__':
+    import sys
+    from speccore import cli
+
+    if len(sys.argv) != 2 and len(sys.argv) != 3:
+        print "usage: python gitimpact.py <project folder> [<commit range>]"
+        sys.exit(2)
+
+    sys.exit(cli.main(['--project', sys.argv[1], '--json', 'impact'] + sys.argv[2:]))
@@ -0,0 +1,84 @@
+import fileslices
+import hashlib
+import marshal
+import os
+import threading
+
+# Bump this whenever the shape of the cached indexes changes so that old
+# snapshots are thrown away instead of being loaded into the wrong structure.
+c_cache_version = 3
+
+
+# A signature is (size, mtime, md5) for each source file. Size and mtime are
+# cheap to compare, the hash catches edits that preserve both (e.g. a checkout
+# that restores an old timestamp).
+def source_signatures(source_paths):
+    signatures = []
+    for path in source_paths:
+        stat = os.stat(path)
+        with open(path, 'rb') as source_file:
+            digest = hashlib.md5(source_file.read()).hexdigest()
+        signatures.append((stat.st_size, stat.st_mtime, digest))
+
+    return signatures
+
+
+# Snapshots live in the editor's cache folder rather than in the project,
+# which is usually someone's git working tree, one file per project folder.
+def cache_path_for(cache_folder, project_folder):
+    project_key = hashlib.md5(os.path.abspath(project_folder).encode('utf-8')).hexdigest()
+    return os.path.join(cache_folder, project_key + '.cache')
+
+
+def load_indexes(cache_path, signatures):
+    try:
+        cache_file = open(cache_path, 'rb')
+    except IOError:
+        return fileslices.err("No index cache at: " + cache_path)
+
+    with cache_file:
+        try:
+            snapshot = marshal.load(cache_file)
+        except (EOFError, ValueError, TypeError):
+            return fileslices.err("The index cache at: " + cache_path + " is corrupt.")
+
+    if not isinstance(snapshot, dict) or snapshot.get('version') != c_cache_version:
+        return fileslices.err("The index cache at: " + cache_path + " is from another version.")
+
+    if snapshot.get('signatures') != signatures:
+        return fileslices.err("The index cache at: " + cache_path + " is stale.")
+
+    return fileslices.ok(snapshot['indexes'])
+
+
+def save_indexes(cache_path, signatures, indexes):
+    snapshot = {
+        'version': c_cache_version,
+        'signatures': signatures,
+        'indexes': indexes
+    }
+
+    # write to a temporary file first so a reader never sees half a snapshot
+    temp_path = cache_path + '.tmp'
+    try:
+        cache_folder = os.path.dirname(cache_path)
+        if not os.path.isdir(cache_folder):
+            os.makedirs(cache_folder)
+
+        with open(temp_path, 'wb') as temp_file:
+            marshal.dump(snapshot, temp_file)
+
+        # os.rename won't overwrite an existing file on Windows
+        if os.path.exists(cache_path):
+            os.remove(cache_path)
+        os.rename(temp_path, cache_path)
+    except (IOError, OSError, ValueError) as error:
+        print "Could not write the index cache: " + str(error)
+
+
+def save_indexes_in_background(cache_path, signatures, indexes):
+    thread = threading.Thread(
+        target=save_indexes, args=(cache_path, signatures, indexes))
+    thread.daemon = True
+    thread.start()
+    return thread
@@ -0,0 +1,90 @@
+"""
+Line coverage of a file by its resources. Every resource is turned into an
+inclusive range of rows; a resource that ends at column 0 of a later row
+doesn't cover that row.
+"""
+
+def resource_rows(resource):
+    first_row = resource['start']['row']
+    last_row = resource['end']['row']
+    if resource['end']['col'] == 0 and last_row > first_row:
+        last_row -= 1
+
+    return first_row, last_row
+
+
+# Merges sorted inclusive row ranges that overlap or touch and returns how
+# many rows they cover together.
+def merged_row_count(row_ranges):
+    total = 0
+    current_first, current_last = None, None
+
+    for first_row, last_row in sorted(row_ranges):
+        if current_last is not None and first_row <= current_last + 1:
+            current_last = max(current_last, last_row)
+            continue
+
+        if current_last is not None:
+            total += current_last - current_first + 1
+        current_first, current_last = first_row, last_row
+
+    if current_last is not None:
+        total += current_last - current_first + 1
+
+    return total
+
+
+"""
+Sweeps over the start and end of every resource of a file once, in row order,
+and returns:
+- 'covered': rows inside at least one resource
+- 'overlapping': rows inside two or more resources
+- 'requirements': {requirement uid: rows covered by that requirement}
+"""
+def file_coverage(resources):
+    events = []
+    ranges_by_uid = {}
+    for resource in resources:
+        first_row, last_row = resource_rows(resource)
+        if last_row < first_row:
+            continue
+
+        # a range opens at its first row and closes right after its last one
+        events.append((first_row, 1))
+        events.append((last_row + 1, -1))
+        ranges_by_uid.setdefault(resource['requirementUid'], []).append(
+            (first_row, last_row))
+
+    events.sort()
+
+    covered = 0
+    overlapping = 0
+    active = 0
+    previous_row = None
+    for row, delta in events:
+        if previous_row is not None:
+            if active > 0:
+                covered += row - previous_row
+            if active > 1:
+                overlapping += row - previous_row
+
+        active += delta
+        previous_row = row
+
+    requirements = {}
+    for uid, row_ranges in ranges_by_uid.iteritems():
+        requirements[uid] = merged_row_count(row_ranges)
+
+    return {
+        'covered': covered,
+        'overlapping': overlapping,
+        'requirements': requirements
+    }
+
+
+def count_lines(file_name):
+    try:
+        with open(file_name, 'rb') as file_to_count:
+            return sum(1 for _ in file_to_count)
+    except IOError:
+        return None
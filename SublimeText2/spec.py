@@ -1,64 +1,24 @@
+import anchoring
 import fileslices
+import gitimpact
+import indexcache
+import itertools
 import json
+import os
+import resourcecoverage
 import sublime, sublime_plugin
 import subprocess
+import threading
+from speccore.transformations import (
+    Indexes, coalesce_resources, coverage_output, deprecated_resource, diff_scope_output,
+    impact_output, indexes_from_json, requirement_string, requirements_by_uid,
+    resource_map_to_json, resource_scan_output, resources_by_requirement,
+    spec_scope_output)
 
 # ==============================================================================
 #  Data Transformations
 # ==============================================================================
 
-def deprecated_resource(uid):
-    return {
-        'uid': uid,
-        'name': 'Deprecated',
-        'description': 'Deprecated resource'
-    }
-
-
-def requirements_by_uid(json_requirements):
-    uids_to_requirements = {}
-    for requirement in json_requirements['requirements']:
-        # Note: maybe warn against requirements that have the same uid
-        #       (that should never happen)
-        uids_to_requirements[requirement['uid']] = { 
-            'uid': requirement['uid'],
-            'name': requirement['name'],
-            'description': requirement['description']
-        }
-
-    return uids_to_requirements
-
-
-def resources_by_file(json_resources):
-    files_to_resources = {}
-    for resource in json_resources:
-        # if a list for this file already exists, 
-        # just append a new entry to the list
-        if resource['uri']['file'] not in files_to_resources:
-            files_to_resources[resource['uri']['file']] = []
-
-        files_to_resources[resource['uri']['file']].append({ 
-            'start': resource['uri']['start'],
-            'end': resource['uri']['end'],
-            'requirementUid': resource['requirementUid']
-        })
-
-    return files_to_resources
-
-
-def requirements_by_file(json_resources):
-    files_to_requirements = {}
-    for resource in json_resources:
-        # if a list for this file already exists,
-        # just append a new entry to the list
-        if resource['uri']['file'] not in files_to_requirements:
-            files_to_requirements[resource['uri']['file']] = set()
-
-        files_to_requirements[resource['uri']['file']].add(resource['requirementUid'])
-
-    return files_to_requirements
-
-
 def dict_to_region(view, json_dict):
     start_row = json_dict['start']['row']
     start_col = json_dict['start']['col']
@@ -80,23 +40,6 @@ def file_name_from_view(view, main_folder):
         return file_name[len(main_folder + '/'):]
 
 
-def resource_map_to_json(resource_map):
-    json_resources = []
-
-    for file_name, resources in resource_map.iteritems():
-        for resource in resources:
-            json_resources.append({
-                'requirementUid': resource['requirementUid'],
-                'uri': {
-                    'file': file_name,
-                    'start': resource['start'],
-                    'end': resource['end']
-                }
-            })
-
-    return json_resources
-
-
 def requirements_at_selection(view, requirement_uids, map_of_all_requirements):
     # Find all regions with requirements in the current view
     requirement_regions = {}
@@ -132,29 +75,29 @@ def requirements_at_selection(view, requirement_uids, map_of_all_requirements):
     return retval
 
 
-def requirement_string(requirement):
-    return [
-        "requirement " + str(requirement['uid']) + ": " + requirement['name'],
-        requirement['description']
-    ]
+def regions_by_requirement(view, requirement_uids):
+    regions_by_uid = {}
+    for uid in requirement_uids:
+        regions_by_uid[uid] = view.get_regions(c_rsrc + str(uid))
+
+    return regions_by_uid
 
 
-def resources_at_cursor(view, cursor_pos, requirement_uids):
+# Works over regions already fetched from the view, so that many cursors can
+# be checked without asking the view for its regions every time.
+def resources_at_point(regions_by_uid, cursor_pos):
     retval = []
 
-    for uid in requirement_uids:
-        key = c_rsrc + str(uid)
-        regions = view.get_regions(key)
+    for uid, regions in regions_by_uid.iteritems():
         for index in range(len(regions)):
             region = regions[index]
             if region.contains(cursor_pos):
                 retval.append((region, uid, index))
 
-    return retval    
+    return retval
 
 
-def smallest_resource_at_cursor(view, cursor_pos, requirement_uids):
-    resources = resources_at_cursor(view, cursor_pos, requirement_uids)
+def smallest_resource(resources):
     if len(resources) == 0:
         return None, None, None
 
@@ -168,6 +111,63 @@ def smallest_resource_at_cursor(view, cursor_pos, requirement_uids):
     return resources[smallest_resource_index]
 
 
+"""
+Works out what assigning every selection to "requirement_uid" does to the
+regions of each requirement, without touching the view. Returns the new
+regions of every affected requirement key, and how many cursors had no
+resource to reassign.
+"""
+def assign_changes(regions_by_uid, selections, requirement_uid):
+    removed_by_uid = {}
+    added = []
+    num_skipped = 0
+
+    for region in selections:
+        # if the selection covers a region of text
+        if region.size() > 0:
+            added.append(region)
+
+        # otherwise the region is a cursor at a location
+        else:
+            resource, uid, index = smallest_resource(
+                resources_at_point(regions_by_uid, region.begin()))
+            if resource is None:
+                num_skipped += 1
+                continue
+
+            removed_by_uid.setdefault(uid, set()).add(index)
+            added.append(resource)
+
+    changes = {}
+    for uid, indices in removed_by_uid.iteritems():
+        changes[c_rsrc + str(uid)] = [kept_region
+            for regions_index, kept_region in enumerate(regions_by_uid[uid])
+            if regions_index not in indices]
+
+    key_to_add = c_rsrc + str(requirement_uid)
+    if key_to_add in changes:
+        regions_to_add = changes[key_to_add]
+    else:
+        regions_to_add = regions_by_uid.get(requirement_uid, [])
+    changes[key_to_add] = coalesce_regions(regions_to_add + added)
+
+    return changes, num_skipped
+
+
+# Merges regions that overlap or touch into one, keeping regions that are
+# really separate as they are. The result is sorted.
+def coalesce_regions(regions):
+    merged = []
+    for region in sorted(regions, key=lambda region: (region.begin(), region.end())):
+        if len(merged) > 0 and region.begin() <= merged[-1].end():
+            if region.end() > merged[-1].end():
+                merged[-1] = sublime.Region(merged[-1].begin(), region.end())
+        else:
+            merged.append(sublime.Region(region.begin(), region.end()))
+
+    return merged
+
+
 def add_regions_flags(is_showing_resources):
     if is_showing_resources:
         return sublime.PERSISTENT | sublime.DRAW_EMPTY | sublime.DRAW_OUTLINED
@@ -175,108 +175,266 @@ def add_regions_flags(is_showing_resources):
         return sublime.PERSISTENT | sublime.HIDDEN
 
 
+# ==============================================================================
+#  Procedures
+# ==============================================================================
+
 """
-NOTE: Technically this is not a pure function (in fact it just does side effects)
-      but it is used as a local mutation inside otherwise pure functions for
-      optimization purposes.
+Replaces the regions of every key in "changes" ({key: new regions}) with one
+add_regions or erase_regions per key. The old regions are kept under hidden
+backup keys, which Sublime moves along with any later edits, so that
+undo_resource_changes can put the whole batch back at once. Keys whose
+regions don't change are left alone, and a batch that changes nothing isn't
+recorded at all.
 """
-def write_spec_output_requirement(c_string_io, requirement):
-    c_string_io.write("\n")
-    c_string_io.write("------------\n")
-    c_string_io.write("requirement #" + str(requirement['uid']) + "\n")
-    c_string_io.write("Name: " + requirement['name'] + "\n")
-    c_string_io.write("Description:\n")
-    c_string_io.write(requirement['description'] + "\n")
+def apply_resource_changes(view, changes):
+    global g_next_transaction_id
 
+    changes = dict((key, regions) for key, regions in changes.iteritems()
+        if region_spans(regions) != region_spans(view.get_regions(key)))
+    if len(changes) == 0:
+        return
 
-"""
-NOTE: Technically this is not a pure function (in fact it just does side effects)
-      but it is used as a local mutation inside otherwise pure functions for
-      optimization purposes.
-"""
-def write_spec_output_resource(c_string_io, resource):
-    c_string_io.write(
-        resource['file'] + ":" + 
-        str(resource['start']['row'] + 1) + ":" + 
-        str(resource['start']['col']) + "-" +
-        str(resource['end']['row'] + 1) + ":" + 
-        str(resource['end']['col']) + "\n")
+    transaction_id = g_next_transaction_id
+    g_next_transaction_id += 1
 
+    for key, regions in changes.iteritems():
+        view.add_regions(c_undo_prefix + str(transaction_id) + key,
+            view.get_regions(key), "", "", sublime.HIDDEN)
 
-def spec_scope_output(spec_scope):
-    from cStringIO import StringIO
-    output = StringIO()
+        if len(regions) == 0:
+            view.erase_regions(key)
+        else:
+            view.add_regions(key, regions, c_scope, c_icon,
+                add_regions_flags(g_is_showing_resources))
 
-    output.write("Unaddressed requirements\n")
-    output.write("====================\n")
-    for requirement in spec_scope['requirementsNotAddressed']:
-        write_spec_output_requirement(output, requirement)
+    transactions = g_transactions_by_view.setdefault(view.id(), [])
+    transactions.append((transaction_id, changes.keys()))
 
-    output.write("\n\n")
-    output.write("Unassociated (potentially deprecated) resources\n")
-    output.write("===============================================\n")
-    for resource in spec_scope['resourcesNotLinked']:
-        write_spec_output_resource(output, resource['uri'])
+    # only keep a limited history
+    if len(transactions) > c_max_transactions:
+        oldest_id, keys = transactions.pop(0)
+        for key in keys:
+            view.erase_regions(c_undo_prefix + str(oldest_id) + key)
 
-    return output.getvalue()
 
+def region_spans(regions):
+    return [(region.begin(), region.end()) for region in regions]
 
-def diff_scope_output(diff_scope):
-    from cStringIO import StringIO
-    output = StringIO()
 
-    output.write("New or Unaddressed requirements\n")
-    output.write("===========================\n")
-    for requirement in diff_scope['requirementsToAddress']:
-        write_spec_output_requirement(output, requirement)
+def undo_resource_changes(view):
+    transactions = g_transactions_by_view.get(view.id(), [])
+    if len(transactions) == 0:
+        return False
 
-    output.write("\n\n")
-    output.write("Resources to Update\n")
-    output.write("===================\n")
-    for resource in diff_scope['resourcesToUpdate']:
-        write_spec_output_resource(output, resource['uri'])
+    transaction_id, keys = transactions.pop()
+    for key in keys:
+        backup_key = c_undo_prefix + str(transaction_id) + key
+        regions = view.get_regions(backup_key)
+        view.erase_regions(backup_key)
 
-    output.write("\n\n")
-    output.write("Deprecated Resources\n")
-    output.write("====================\n")
-    for resource in diff_scope['deprecatedResources']:
-        write_spec_output_resource(output, resource['uri'])
+        if len(regions) == 0:
+            view.erase_regions(key)
+        else:
+            view.add_regions(key, regions, c_scope, c_icon,
+                add_regions_flags(g_is_showing_resources))
 
-    return output.getvalue()
+    return True
 
 
-def resources_by_requirement(requirement, _resources_by_file):
-    from cStringIO import StringIO
-    output = StringIO()
+def reanchor_regions(view, resources, regions):
+    # Resources are stored as rows and cols, so an edit made outside the
+    # editor shifts everything after it. Any region whose text no longer
+    # matches its fingerprint is looked up again by content and replaced
+    # in place in "regions".
+    text = view.substr(sublime.Region(0, view.size()))
 
-    write_spec_output_requirement(output, requirement)
+    drifted = []
+    for index, (resource, region) in enumerate(zip(resources, regions)):
+        _fingerprint = resource.get('fingerprint')
+        if _fingerprint is None:
+            continue
 
-    output.write("\n")
-    output.write("Associated Resources:\n")
+        if not anchoring.is_anchored(text, region.begin(), region.end(), _fingerprint):
+            drifted.append(index)
 
-    for file_name, resources in _resources_by_file.iteritems():
-        for resource in resources:
-            resource['file'] = file_name
-            if requirement['uid'] == resource['requirementUid']:
-                write_spec_output_resource(output, resource)
-    return output.getvalue()
+    if len(drifted) == 0:
+        return
 
+    anchors = [(regions[index].begin(), resources[index]['fingerprint'])
+        for index in drifted]
+    new_locations = anchoring.reanchor(text, anchors)
+
+    for index, new_location in zip(drifted, new_locations):
+        if new_location is None:
+            print "Could not re-anchor a resource of requirement #" + \
+                str(resources[index]['requirementUid']) + " in " + view.file_name()
+            continue
+
+        regions[index] = sublime.Region(new_location[0], new_location[1])
+
+
+# Builds the indexes of the project in "main_folder", from the index cache
+# when spec.json and resources.json haven't changed. Touches no view or
+# global state, so it is safe to run off the UI thread.
+def load_indexes(main_folder, cache_folder):
+    try:
+        spec_file = open(main_folder + '/spec.json', 'r')
+    except IOError:
+        return fileslices.err("Could not find spec.json at the root of the project.")
+
+    try:
+        resources_file = open(main_folder + '/resources.json', 'r')
+    except IOError:
+        spec_file.close()
+        return fileslices.err("Could not find resources.json at the root fo the project.")
+
+    with spec_file:
+        with resources_file:
+            # skip parsing entirely if neither json file changed since the last session
+            cache_path = indexcache.cache_path_for(cache_folder, main_folder)
+            signatures = indexcache.source_signatures(
+                [main_folder + '/spec.json', main_folder + '/resources.json'])
+            cached_indexes = indexcache.load_indexes(cache_path, signatures)
+            if cached_indexes.is_ok():
+                return fileslices.ok(Indexes(*cached_indexes.ok))
+
+            print cached_indexes.err
+
+            try:
+                indexes = indexes_from_json(json.load(spec_file), json.load(resources_file))
+            except (ValueError, KeyError) as error:
+                return fileslices.err("Could not read spec.json and resources.json: " + str(error))
+
+    indexcache.save_indexes_in_background(cache_path, signatures, indexes.as_tuple())
+    return fileslices.ok(indexes)
+
+
+# Swaps in a new snapshot with a single assignment to g_indexes. Readers take
+# g_indexes once and use that snapshot throughout, so a rebuild running on
+# another thread never blocks them or shows them a half-built index.
+def publish_indexes(indexes):
+    global g_indexes
+    global g_coverage_by_file
+
+    g_indexes = indexes
+    g_coverage_by_file = {}
+
+
+# Runs "build" on a background thread and hands the snapshot it returns to
+# "publish" back on the UI thread, where every other change to g_indexes
+# happens, so that a rebuild can never overwrite a change made meanwhile.
+# A build that raises is reported to "on_error" like one that returns an
+# error, so that nothing waits on a thread that has died.
+def rebuild_indexes_in_background(build, publish, on_error=None):
+    def rebuild():
+        try:
+            result = build()
+        except Exception as error:
+            result = fileslices.err("Could not load the project: " + repr(error))
+
+        if not result.is_ok():
+            print result.err
+            if on_error is not None:
+                sublime.set_timeout(lambda: on_error(result.err), 0)
+            return
+
+        sublime.set_timeout(lambda: publish(result.ok), 0)
+
+    thread = threading.Thread(target=rebuild)
+    thread.daemon = True
+    thread.start()
+    return thread
+
+
+def write_resources_json():
+    # whichever save gets the lock last writes the newest snapshot,
+    # so an older save can never overwrite a newer one
+    with g_resources_json_lock:
+        json_resources = resource_map_to_json(g_indexes.resources_by_file)
+        with open(g_main_folder + '/resources.json', 'w') as resources_file:
+            json.dump(json_resources, resources_file, indent=4)
 
-# ==============================================================================
-#  Procedures
-# ==============================================================================
 
-def erase_region_at_index(view, key, index):
-    # I can't erase particular regions of a view.
-    # I can only erase all regions of a view given a key.
-    # So, this deletes all regions of the resource's key
-    # and then add the regions that weren't the resource back
-    # to the view. 
-    regions = view.get_regions(key)
-    del regions[index]
-    view.erase_regions(key)
-    view.add_regions(key, regions, c_scope, c_icon, 
-        add_regions_flags(g_is_showing_resources))
+# Reads the file to count its lines, and touches no global state, so it is
+# safe to run off the UI thread.
+def measure_coverage(main_folder, indexes, file_name):
+    coverage = resourcecoverage.file_coverage(indexes.resources_by_file.get(file_name, []))
+    coverage['lines'] = resourcecoverage.count_lines(main_folder + '/' + file_name)
+    return coverage
+
+
+def coverage_of_file(indexes, file_name):
+    # coverage only changes when resources are written, so it is kept
+    # until the file is saved again
+    if file_name not in g_coverage_by_file:
+        g_coverage_by_file[file_name] = measure_coverage(g_main_folder, indexes, file_name)
+
+    return g_coverage_by_file[file_name]
+
+
+def update_coverage_status(view):
+    if not g_show_coverage_in_status_bar:
+        view.erase_status(c_coverage_status_key)
+        return
+
+    indexes = g_indexes
+    file_name = file_name_from_view(view, g_main_folder)
+    if file_name is None or file_name not in indexes.resources_by_file:
+        view.erase_status(c_coverage_status_key)
+        return
+
+    coverage = coverage_of_file(indexes, file_name)
+    if not coverage['lines']:
+        view.erase_status(c_coverage_status_key)
+        return
+
+    percent = 100.0 * coverage['covered'] / coverage['lines']
+    view.set_status(c_coverage_status_key, "Spec coverage: {0:.0f}%".format(percent))
+
+
+def mark_resources(view):
+    file_name = file_name_from_view(view, g_main_folder)
+    if file_name is None:
+        print "Current file does not have a name."
+        return
+
+    try:
+        # get all text regions that are considered "resources"
+        # in the current file
+        resources = g_indexes.resources_by_file[file_name]
+
+    except KeyError:
+        resources = []
+        return
+    
+    # mark all the text regions as resources
+    regions = [dict_to_region(view, resource) for resource in resources]
+    reanchor_regions(view, resources, regions)
+
+    regions_by_uid = {}
+    for resource, region in zip(resources, regions):
+        if resource['requirementUid'] not in regions_by_uid:
+            regions_by_uid[resource['requirementUid']] = []
+
+        regions_by_uid[resource['requirementUid']].append(region)
+
+    # create the marked regions, but hidden
+    for uid, region in regions_by_uid.iteritems():
+        key = c_rsrc + str(uid)
+        view.add_regions(key, region, c_scope, c_icon,
+            sublime.PERSISTENT | sublime.HIDDEN)
+
+
+def is_loaded():
+    if g_main_has_run:
+        return True
+
+    if g_is_loading:
+        sublime.status_message("Spec is still loading spec.json and resources.json...")
+    else:
+        sublime.status_message("Spec has no project loaded.")
+    return False
 
 
 def display_in_new_file(window, to_display):
@@ -286,6 +444,39 @@ def display_in_new_file(window, to_display):
     new_view.end_edit(edit)
 
 
+def expanded_hooks(view):
+    return view.settings().get(c_expanded_hooks_setting, [])
+
+
+def set_expanded_hooks(view, hooks):
+    view.settings().set(c_expanded_hooks_setting, sorted(set(hooks)))
+
+
+def read_file_slice(file_hook):
+    file_slice = fileslices.slice_from_hook(g_main_folder + "/" + file_hook, 3)
+    if not file_slice.is_ok():
+        print file_slice.err
+        return None
+
+    return "\n" + fileslices.slice_to_string(file_slice.ok,
+        g_peek_max_lines, g_peek_max_bytes, g_peek_max_line_width) + "\n"
+
+
+def erase_file_slices(view, edit, hooks):
+    regions = []
+    for hook in hooks:
+        regions.extend(view.get_regions(hook))
+
+    # erase from the bottom up so that the regions still to be erased stay put
+    for region in sorted(regions, key=lambda region: region.begin(), reverse=True):
+        view.erase(edit, region)
+
+    for hook in hooks:
+        view.erase_regions(hook)
+
+    set_expanded_hooks(view, [hook for hook in expanded_hooks(view) if hook not in hooks])
+
+
 def insert_file_slice(view, file_hook, insert_pos):
     hook_to_check = g_main_folder + "/" + file_hook
     file_slice = fileslices.slice_from_hook(hook_to_check, 3)
@@ -293,14 +484,42 @@ def insert_file_slice(view, file_hook, insert_pos):
         print file_slice.err
         return
 
-    to_insert = "\n" + fileslices.slice_to_string(file_slice.ok) + "\n"
-    edit = view.begin_edit()
-    num_chars_inserted = view.insert(edit, insert_pos, to_insert)
-    view.end_edit(edit)
+    lines = fileslices.iter_slice_lines(file_slice.ok,
+        g_peek_max_lines, g_peek_max_bytes, g_peek_max_line_width)
+
+    def insert_chunk(region):
+        # insert the slice a chunk of lines at a time, giving the UI a chance
+        # to breathe in between so that a huge slice doesn't freeze the editor
+        chunk = list(itertools.islice(lines, c_peek_chunk_lines))
+        is_last_chunk = len(chunk) < c_peek_chunk_lines
+
+        to_insert = "".join(line + "\n" for line in chunk)
+        if region.empty():
+            to_insert = "\n" + to_insert
+        if is_last_chunk:
+            to_insert += "\n"
+
+        edit = view.begin_edit()
+        num_chars_inserted = view.insert(edit, region.end(), to_insert)
+        view.end_edit(edit)
+
+        region = sublime.Region(region.begin(), region.end() + num_chars_inserted)
+        view.add_regions(file_hook, [region], c_scope, c_icon,
+            sublime.HIDDEN | sublime.HIDE_ON_MINIMAP)
 
-    region = sublime.Region(insert_pos, insert_pos + num_chars_inserted)
-    view.add_regions(file_hook, [region], c_scope, c_icon,
-        sublime.HIDDEN | sublime.HIDE_ON_MINIMAP)
+        if not is_last_chunk:
+            sublime.set_timeout(insert_next_chunk, 0)
+
+    def insert_next_chunk():
+        # the slice was hidden (or the view closed) before it finished
+        regions = view.get_regions(file_hook)
+        if len(regions) == 0:
+            return
+
+        insert_chunk(regions[0])
+
+    insert_chunk(sublime.Region(insert_pos, insert_pos))
+    set_expanded_hooks(view, expanded_hooks(view) + [file_hook])
 
 
 # ==============================================================================
@@ -309,41 +528,33 @@ def insert_file_slice(view, file_hook, insert_pos):
 
 class MarkResourcesOnLoad(sublime_plugin.EventListener):
     def on_load(self, view):
+        # views opened while the indexes are still loading are marked as soon
+        # as loading finishes; main() does nothing while a load is running,
+        # and otherwise tries again after a failed one
         if not g_main_has_run:
             main()
-
-        file_name = file_name_from_view(view, g_main_folder)
-        if file_name is None:
-            print "Current file does not have a name."
             return
 
-        try:
-            # get all text regions that are considered "resources"
-            # in the current file
-            resources = g_resources_by_file[file_name]
+        mark_resources(view)
 
-        except KeyError:
-            resources = []
-            return
-        
-        # mark all the text regions as resources
-        regions_by_uid = {}
-        for resource in resources:
-            if resource['requirementUid'] not in regions_by_uid:
-                regions_by_uid[resource['requirementUid']] = []
 
-            regions_by_uid[resource['requirementUid']].append(dict_to_region(view, resource))
+class ForgetResourceChangesOnClose(sublime_plugin.EventListener):
+    def on_close(self, view):
+        # the backup regions go away with the view, so its history can't be undone
+        g_transactions_by_view.pop(view.id(), None)
 
-        # create the marked regions, but hidden
-        for uid, region in regions_by_uid.iteritems():
-            key = c_rsrc + str(uid)
-            view.add_regions(key, region, c_scope, c_icon,
-                sublime.PERSISTENT | sublime.HIDDEN)
+
+class CoverageStatusOnActivate(sublime_plugin.EventListener):
+    def on_activated(self, view):
+        update_coverage_status(view)
 
 
 class WriteResourcesOnSave(sublime_plugin.EventListener):
     def on_post_save(self, view):
-        global g_resources_by_file
+        # nothing has been marked yet, and writing out the empty indexes
+        # would wipe resources.json
+        if not g_main_has_run:
+            return
 
         file_name = file_name_from_view(view, g_main_folder)
         if file_name is None:
@@ -356,11 +567,12 @@ class WriteResourcesOnSave(sublime_plugin.EventListener):
 
         # reset all resources in the current file
         try:
-            requirement_uids = g_requirements_by_file[file_name]
+            requirement_uids = g_indexes.requirements_by_file[file_name]
         except KeyError:
             return
 
-        g_resources_by_file[file_name] = []
+        resources = []
+        text = view.substr(sublime.Region(0, view.size()))
 
         for uid in requirement_uids:
             regions = view.get_regions(c_rsrc + str(uid))
@@ -368,7 +580,7 @@ class WriteResourcesOnSave(sublime_plugin.EventListener):
             for region in regions:
                 start_row, start_col = view.rowcol(region.begin())
                 end_row, end_col = view.rowcol(region.end())
-                g_resources_by_file[file_name].append({
+                resources.append({
                     'requirementUid': uid,
                     'start': {
                         'row': start_row,
@@ -377,14 +589,16 @@ class WriteResourcesOnSave(sublime_plugin.EventListener):
                     'end': {
                         'row': end_row,
                         'col': end_col
-                    }
+                    },
+                    'fingerprint': anchoring.fingerprint(
+                        text, region.begin(), region.end())
                 })
 
-        # make a list for resources.json and save it out
-        json_resources = resource_map_to_json(g_resources_by_file)
+        publish_indexes(g_indexes.with_file_resources(file_name, resources))
+        update_coverage_status(view)
 
-        resources_file = open(g_main_folder + '/resources.json', 'w')
-        json.dump(json_resources, resources_file, indent=4)
+        # make a list for resources.json and save it out
+        threading.Thread(target=write_resources_json).start()
 
 
 # ==============================================================================
@@ -399,13 +613,16 @@ class ShowResourcesCommand(sublime_plugin.TextCommand):
     def run(self, edit):
         global g_is_showing_resources
 
+        if not is_loaded():
+            return
+
         # Get the current file
         file_name = file_name_from_view(self.view, g_main_folder)
         if file_name is None:
             print "Current file does not have a name."
             return
 
-        requirement_uids = g_requirements_by_file[file_name]
+        requirement_uids = g_indexes.requirements_by_file[file_name]
 
         # For every requirement, highlight the text associated with that requirement
         for uid in requirement_uids:
@@ -427,13 +644,16 @@ class HideResourcesCommand(sublime_plugin.TextCommand):
     def run(self, edit):
         global g_is_showing_resources
 
+        if not is_loaded():
+            return
+
         # Get the current file
         file_name = file_name_from_view(self.view, g_main_folder)        
         if file_name is None:
             print "Current file does not have a name."
             return
 
-        requirement_uids = g_requirements_by_file[file_name]    
+        requirement_uids = g_indexes.requirements_by_file[file_name]
         regions = []
 
         # For every requirement, find its associated text and de-highlight it
@@ -454,6 +674,9 @@ selection or cursor position.
 """
 class RequirementsAtSelectionCommand(sublime_plugin.WindowCommand):
     def run(self):
+        if not is_loaded():
+            return
+
         # Get the current file
         active_view = self.window.active_view()
         if active_view is None:
@@ -465,10 +688,11 @@ class RequirementsAtSelectionCommand(sublime_plugin.WindowCommand):
             print "Current file does not have a name."
             return
 
+        indexes = g_indexes
         requirements = requirements_at_selection(
             active_view, 
-            g_requirements_by_file[file_name], 
-            g_requirements_by_uid)
+            indexes.requirements_by_file[file_name], 
+            indexes.requirements_by_uid)
 
         string_to_display = ""
         for requirement in requirements:
@@ -499,7 +723,8 @@ any resource, this command will do nothing.
 """
 class AssignResourceCommand(sublime_plugin.WindowCommand):
     def run(self):
-        global g_requirements_by_file
+        if not is_loaded():
+            return
 
         # Get the current file
         active_view = self.window.active_view()
@@ -514,7 +739,7 @@ class AssignResourceCommand(sublime_plugin.WindowCommand):
 
         requirement_strings = []
         string_uids = []
-        for uid, requirement in g_requirements_by_uid.iteritems():
+        for uid, requirement in g_indexes.requirements_by_uid.iteritems():
             requirement_strings.append(requirement_string(requirement))
             string_uids.append(uid)
 
@@ -524,40 +749,34 @@ class AssignResourceCommand(sublime_plugin.WindowCommand):
                 return
 
             requirement_uid = string_uids[index]
-            key_to_add = c_rsrc + str(requirement_uid)
-            regions_to_add = active_view.get_regions(key_to_add)
+            requirement_uids = g_indexes.requirements_by_file.get(file_name, set())
 
-            for region in active_view.sel():
-                # if the selection covers a region of text
-                if region.size() > 0:
-                    if file_name not in g_requirements_by_file:
-                        g_requirements_by_file[file_name] = set()
-                    g_requirements_by_file[file_name].add(requirement_uid)
+            # every cursor is worked out first and the view is then changed
+            # once per requirement, as a single undoable batch
+            regions_by_uid = regions_by_requirement(
+                active_view, requirement_uids | set([requirement_uid]))
+            changes, num_skipped = assign_changes(
+                regions_by_uid, active_view.sel(), requirement_uid)
 
-                    regions_to_add.append(region)
+            if len(changes[c_rsrc + str(requirement_uid)]) > 0 and \
+               requirement_uid not in requirement_uids:
+                publish_indexes(g_indexes.with_requirements_in_file(
+                    file_name, [requirement_uid]))
 
-                    active_view.add_regions(key_to_add, regions_to_add, 
-                        c_scope, c_icon, add_regions_flags(g_is_showing_resources))
+            apply_resource_changes(active_view, changes)
 
-                # otherwise the region is a cursor at a location
-                else:
-                    resource, uid, index = smallest_resource_at_cursor(
-                        active_view, region.begin(), g_requirements_by_file[file_name])
-                    key = c_rsrc + str(uid)
-
-                    if resource is None:
-                        return
-
-                    erase_region_at_index(active_view, key, index)
-                    regions_to_add.append(resource)
-                    active_view.add_regions(key_to_add, regions_to_add, 
-                        c_scope, c_icon, add_regions_flags(g_is_showing_resources))
+            if num_skipped > 0:
+                sublime.status_message("Spec: " + str(num_skipped) +
+                    " cursors were not in a resource and were skipped")
 
         self.window.show_quick_panel(requirement_strings, on_requirement_select)
 
 
 class DissociateResourceCommand(sublime_plugin.WindowCommand):
     def run(self):
+        if not is_loaded():
+            return
+
         # Get the current file
         active_view = self.window.active_view()
         if active_view is None:
@@ -569,37 +788,62 @@ class DissociateResourceCommand(sublime_plugin.WindowCommand):
             print "Current file does not have a name."
             return
 
+        indexes = g_indexes
+        regions_by_uid = regions_by_requirement(
+            active_view, indexes.requirements_by_file.get(file_name, set()))
+
+        resources_to_delete = []
         for cursor_pos in active_view.sel():
-            resources_to_delete = resources_at_cursor(
-                active_view, cursor_pos.begin(), g_requirements_by_file[file_name])
+            resources_to_delete.extend(resources_at_point(regions_by_uid, cursor_pos.begin()))
+
+        if len(resources_to_delete) == 0:
+            print "No resources to dissociate at cursor position."
+            return
+
+        # one quick panel for all of the cursors, listing every requirement
+        # that has a resource under any of them
+        uids = sorted(set(uid for _, uid, _ in resources_to_delete))
+        requirement_strings = []
+        for uid in uids: 
+            if uid not in indexes.requirements_by_uid:
+                _requirement_string = requirement_string(deprecated_resource(uid))
+            else:
+                _requirement_string = requirement_string(indexes.requirements_by_uid[uid])
 
-            if len(resources_to_delete) == 0:
-                print "No resources to dissociate at cursor position."
+            requirement_strings.append(_requirement_string)
+
+        def on_requirement_select(index):
+            # "index" will be -1 if no requirement was selected
+            if index == -1:
                 return
 
-            requirement_strings = []
-            for _, uid, _ in resources_to_delete: 
-                if uid not in g_requirements_by_uid:
-                    _requirement_string = requirement_string(deprecated_resource(uid))
-                else:
-                    _requirement_string = requirement_string(g_requirements_by_uid[uid])
+            uid = uids[index]
+            indices = set(regions_index
+                for _, resource_uid, regions_index in resources_to_delete
+                if resource_uid == uid)
+            remaining = [region for regions_index, region in enumerate(regions_by_uid[uid])
+                if regions_index not in indices]
 
-                requirement_strings.append(_requirement_string)
+            apply_resource_changes(active_view, {c_rsrc + str(uid): remaining})
 
-            def on_requirement_select(index):
-                # "index" will be -1 if no requirement was selected
-                if index == -1:
-                    return
+        self.window.show_quick_panel(requirement_strings, on_requirement_select)
 
-                resource, uid, regions_index = resources_to_delete[index]
-                key = c_rsrc + str(uid)
-                erase_region_at_index(active_view, key, regions_index)
 
-            self.window.show_quick_panel(requirement_strings, on_requirement_select)
+"""
+Puts back the resources changed by the last assign, dissociate or compact in
+the current file, however many cursors it covered.
+"""
+class UndoResourceChangesCommand(sublime_plugin.TextCommand):
+    def run(self, edit):
+        if not undo_resource_changes(self.view):
+            sublime.status_message("Spec: no resource changes to undo")
 
 
 class SpecScopeCommand(sublime_plugin.WindowCommand):
     def run(self):
+        if not is_loaded():
+            return
+
         try:
             cmd = g_spec_path + " scope --spec \"" + g_main_folder + "/spec.json\" --resources \"" + g_main_folder + "/resources.json\""
             proc = subprocess.Popen([cmd],
@@ -619,6 +863,9 @@ class SpecScopeCommand(sublime_plugin.WindowCommand):
 
 class DiffScopeCommand(sublime_plugin.WindowCommand):
     def run(self):
+        if not is_loaded():
+            return
+
         def on_diff_path_entered(diff_path):
             # first make sure that the diff_path is a valid file before blindly
             # running a shell command with it
@@ -653,24 +900,106 @@ class DiffScopeCommand(sublime_plugin.WindowCommand):
             "Path to diff file", "./diff.json", on_diff_path_entered, None, None)
 
 
+"""
+Lists the requirements whose resources overlap the lines changed since the
+last commit, staged or not, or in a commit range such as "master..HEAD".
+"""
+class RequirementImpactCommand(sublime_plugin.WindowCommand):
+    def run(self):
+        if not is_loaded():
+            return
+
+        def on_commit_range_entered(commit_range):
+            indexes = g_indexes
+            impact = gitimpact.impact_of_diff(
+                g_main_folder, indexes.resources_by_file, commit_range.strip())
+            if not impact.is_ok():
+                print impact.err
+                return
+
+            details = impact_output(impact.ok, indexes.requirements_by_uid)
+            display_in_new_file(self.window, details)
+
+        self.window.show_input_panel(
+            "Commit range (leave empty for uncommitted changes)", "",
+            on_commit_range_entered, None, None)
+
+
 class ReloadSpecCommand(sublime_plugin.TextCommand):
     def run(self, edit):
-        try:
-            spec_file = open(g_main_folder + '/spec.json', 'r')
-        except IOError:
-            print "Could not find spec.json at the root of the project."
+        # a project that failed to load is loaded again from scratch
+        if not g_main_has_run and not g_is_loading:
+            main()
+            return
+
+        if not is_loaded():
+            return
+
+        main_folder = g_main_folder
+
+        def load_spec():
+            try:
+                spec_file = open(main_folder + '/spec.json', 'r')
+            except IOError:
+                return fileslices.err("Could not find spec.json at the root of the project.")
+
+            with spec_file:
+                return fileslices.ok(requirements_by_uid(json.load(spec_file)))
+
+        # resources may have changed while the spec was loading, so the new
+        # requirements are applied to whatever snapshot is current by then
+        rebuild_indexes_in_background(load_spec,
+            lambda _requirements_by_uid: publish_indexes(
+                g_indexes.with_requirements(_requirements_by_uid)))
+
+
+"""
+Merges the overlapping and touching resources of each requirement, both in
+the open views and in resources.json. Resources that don't touch are left
+alone.
+"""
+class CompactResourcesCommand(sublime_plugin.WindowCommand):
+    def run(self):
+        if not is_loaded():
             return
 
-        with spec_file:
-            json_spec = json.load(spec_file)
-            g_requirements_by_uid = requirements_by_uid(json_spec)
+        indexes = g_indexes
+
+        # open views hold the live regions, which are what gets saved
+        for window in sublime.windows():
+            for view in window.views():
+                file_name = file_name_from_view(view, g_main_folder)
+                if file_name is None or file_name not in indexes.requirements_by_file:
+                    continue
+
+                changes = {}
+                for uid in indexes.requirements_by_file[file_name]:
+                    key = c_rsrc + str(uid)
+                    changes[key] = coalesce_regions(view.get_regions(key))
+                apply_resource_changes(view, changes)
+
+        _resources_by_file = {}
+        num_merged = 0
+        for file_name, resources in indexes.resources_by_file.iteritems():
+            _resources_by_file[file_name] = coalesce_resources(resources)
+            num_merged += len(resources) - len(_resources_by_file[file_name])
+
+        publish_indexes(Indexes(indexes.requirements_by_uid, _resources_by_file,
+            indexes.requirements_by_file))
+        threading.Thread(target=write_resources_json).start()
+
+        sublime.status_message("Spec: merged " + str(num_merged) + " resources")
 
 
 class ResourcesForRequirement(sublime_plugin.WindowCommand):
     def run(self):
+        if not is_loaded():
+            return
+
+        indexes = g_indexes
         requirement_strings = []
         string_uids = []
-        for uid, requirement in g_requirements_by_uid.iteritems():
+        for uid, requirement in indexes.requirements_by_uid.iteritems():
             requirement_strings.append(requirement_string(requirement))
             string_uids.append(uid)
 
@@ -680,12 +1009,73 @@ class ResourcesForRequirement(sublime_plugin.WindowCommand):
                 return
 
             resource_listing = resources_by_requirement(
-                g_requirements_by_uid[string_uids[index]], g_resources_by_file)
+                indexes.requirements_by_uid[string_uids[index]], indexes.resources_by_file)
             display_in_new_file(self.window, resource_listing)
 
         self.window.show_quick_panel(requirement_strings, on_requirement_select)
 
 
+"""
+Checks every resource in resources.json against the file it points to and
+lists the ones whose file is gone, whose rows/cols are past the end of the
+file, or which cover no text at all.
+"""
+class ScanResourcesCommand(sublime_plugin.WindowCommand):
+    def run(self):
+        if not is_loaded():
+            return
+
+        main_folder = g_main_folder
+        files_to_resources = g_indexes.resources_by_file
+
+        # the embedded interpreter can't spawn worker processes, so the pool
+        # is left to the command line and the scan runs on this thread alone
+        def scan():
+            problems = fileslices.scan_resources(main_folder, files_to_resources, 1)
+            details = resource_scan_output(problems)
+            sublime.set_timeout(lambda: display_in_new_file(self.window, details), 0)
+
+        sublime.status_message("Scanning resources...")
+        threading.Thread(target=scan).start()
+
+
+"""
+Shows what fraction of the lines of each file with resources is linked to a
+requirement, and how many lines each requirement covers.
+"""
+class CoverageReportCommand(sublime_plugin.WindowCommand):
+    def run(self):
+        if not is_loaded():
+            return
+
+        main_folder = g_main_folder
+        indexes = g_indexes
+        cached_coverage = dict(g_coverage_by_file)
+
+        # counting the lines of every file can take a while on a big project,
+        # so it happens on a background thread
+        def report():
+            coverage_by_file = {}
+            for file_name in indexes.resources_by_file.iterkeys():
+                if file_name in cached_coverage:
+                    coverage_by_file[file_name] = cached_coverage[file_name]
+                else:
+                    coverage_by_file[file_name] = measure_coverage(main_folder, indexes, file_name)
+
+            details = coverage_output(coverage_by_file, indexes.requirements_by_uid)
+            sublime.set_timeout(lambda: show_report(coverage_by_file, details), 0)
+
+        def show_report(coverage_by_file, details):
+            # only keep the counts if no save has replaced the snapshot meanwhile
+            if g_indexes is indexes:
+                g_coverage_by_file.update(coverage_by_file)
+
+            display_in_new_file(self.window, details)
+
+        sublime.status_message("Measuring coverage...")
+        threading.Thread(target=report).start()
+
+
 class OpenFileOnLine(sublime_plugin.TextCommand):
     def run(self, edit):
         for selected_region in self.view.sel():
@@ -698,6 +1088,9 @@ class OpenFileOnLine(sublime_plugin.TextCommand):
 
 class PeekFileOnLine(sublime_plugin.TextCommand):
     def run(self, edit):
+        if not is_loaded():
+            return
+
         for selected_region in self.view.sel():
             regions = self.view.lines(self.view.line(selected_region))
             for region in regions:
@@ -711,18 +1104,76 @@ class PeekFileOnLine(sublime_plugin.TextCommand):
 
 class HideFileOnLine(sublime_plugin.TextCommand):
     def run(self, edit):
+        hooks = []
         for selected_region in self.view.sel():
             hook_regions = self.view.lines(self.view.line(selected_region))
             for hook_region in hook_regions:
-                hook = self.view.substr(hook_region)
-                file_content_regions = self.view.get_regions(hook)
+                hooks.append(self.view.substr(hook_region))
+
+        erase_file_slices(self.view, edit, hooks)
+
+
+"""
+Inserts the file slice of every hook in the current file that isn't already
+showing one. The slices are read concurrently and inserted in a single edit,
+so the whole expansion is undone in one step.
+"""
+class ExpandAllHooksCommand(sublime_plugin.TextCommand):
+    def run(self, edit):
+        if not is_loaded():
+            return
 
-                for region in file_content_regions:
-                    edit = self.view.begin_edit()
-                    self.view.erase(edit, region)
-                    self.view.end_edit(edit)
+        from multiprocessing.pool import ThreadPool
 
-                self.view.erase_regions(hook)
+        hook_regions = [region for region in self.view.find_all(c_hook_pattern)
+            if len(self.view.get_regions(self.view.substr(region))) == 0]
+        if len(hook_regions) == 0:
+            return
+
+        hooks = list(set(self.view.substr(region) for region in hook_regions))
+
+        pool = ThreadPool(min(len(hooks), c_max_hook_readers))
+        try:
+            slices = dict(zip(hooks, pool.map(read_file_slice, hooks)))
+        finally:
+            pool.close()
+            pool.join()
+
+        # go from the bottom of the file up, so that inserting one slice
+        # never moves the hooks that are still waiting for theirs
+        inserted = []
+        for hook_region in sorted(hook_regions, key=lambda region: region.begin(), reverse=True):
+            hook = self.view.substr(hook_region)
+            if slices[hook] is None:
+                continue
+
+            insert_pos = min(hook_region.end() + 1, self.view.size())
+            num_chars_inserted = self.view.insert(edit, insert_pos, slices[hook])
+            inserted.append((hook, insert_pos, num_chars_inserted))
+
+        # every slice was shifted down by all of the slices inserted above it
+        regions_by_hook = {}
+        shift = sum(num_chars for _, _, num_chars in inserted)
+        for hook, insert_pos, num_chars_inserted in inserted:
+            shift -= num_chars_inserted
+            begin = insert_pos + shift
+            regions_by_hook.setdefault(hook, []).append(
+                sublime.Region(begin, begin + num_chars_inserted))
+
+        for hook, regions in regions_by_hook.iteritems():
+            self.view.add_regions(hook, regions, c_scope, c_icon,
+                sublime.HIDDEN | sublime.HIDE_ON_MINIMAP)
+
+        set_expanded_hooks(self.view, expanded_hooks(self.view) + regions_by_hook.keys())
+
+
+"""
+Removes every file slice inserted by "Peek File on Line" or "Expand All Hooks"
+in a single edit.
+"""
+class CollapseAllHooksCommand(sublime_plugin.TextCommand):
+    def run(self, edit):
+        erase_file_slices(self.view, edit, expanded_hooks(self.view))
 
 
 # ==============================================================================
@@ -733,26 +1184,103 @@ c_rsrc = "rsrc"
 c_scope = "meta.block"
 c_icon = "bookmark"
 c_base_name = "Spec.sublime-settings"
+c_cache_folder_name = "Spec"
+c_coverage_status_key = "spec_coverage"
+c_peek_chunk_lines = 500
+c_hook_pattern = r"^[^\s:]+:[0-9]+(:[0-9]+)?(-[0-9]+(:[0-9]+)?)?$"
+c_max_hook_readers = 16
+c_undo_prefix = "spec_undo_"
+c_max_transactions = 20
+c_expanded_hooks_setting = "spec_expanded_hooks"
+c_folder_retry_ms = 1000
+c_max_folder_retries = 30
+c_progress_interval_ms = 250
 g_main_folder = ""
-g_requirements_by_uid = {}
-g_resources_by_file = {}
-g_requirements_by_file = {}
+g_indexes = Indexes()
+g_resources_json_lock = threading.Lock()
 g_main_has_run = False
+g_is_loading = False
 g_is_showing_resources = False
 g_spec_path = "spec"
+g_coverage_by_file = {}
+g_transactions_by_view = {}
+g_next_transaction_id = 0
+g_show_coverage_in_status_bar = False
+g_peek_max_lines = 2000
+g_peek_max_bytes = 1024 * 1024
+g_peek_max_line_width = 500
+
+def load_settings():
+    global g_spec_path
+    global g_show_coverage_in_status_bar
+    global g_peek_max_lines
+    global g_peek_max_bytes
+    global g_peek_max_line_width
 
-def main():
-    global g_main_folder
-    global g_requirements_by_uid
-    global g_resources_by_file
-    global g_requirements_by_file
+    settings = sublime.load_settings(c_base_name)
+    g_spec_path = settings.get("spec_path", "spec")
+
+    def set_spec_path(spec_path):
+        global g_spec_path
+        g_spec_path = spec_path
+
+    settings.add_on_change("spec_path", set_spec_path)
+
+    g_show_coverage_in_status_bar = settings.get("show_coverage_in_status_bar", False)
+
+    def set_show_coverage_in_status_bar():
+        global g_show_coverage_in_status_bar
+        g_show_coverage_in_status_bar = settings.get("show_coverage_in_status_bar", False)
+
+    settings.add_on_change("show_coverage_in_status_bar", set_show_coverage_in_status_bar)
+
+    g_peek_max_lines = settings.get("peek_max_lines", g_peek_max_lines)
+    g_peek_max_bytes = settings.get("peek_max_bytes", g_peek_max_bytes)
+    g_peek_max_line_width = settings.get("peek_max_line_width", g_peek_max_line_width)
+
+
+def show_loading_progress(step=0):
+    if not g_is_loading:
+        return
+
+    sublime.status_message("Spec: loading project" + "." * (step % 4))
+    sublime.set_timeout(lambda: show_loading_progress(step + 1), c_progress_interval_ms)
+
+
+def on_indexes_loaded(indexes):
     global g_main_has_run
-    global g_spec_path
+    global g_is_loading
 
-    if g_main_has_run:
+    publish_indexes(indexes)
+    g_main_has_run = True
+    g_is_loading = False
+    sublime.status_message("Spec: loaded " + str(len(indexes.requirements_by_uid)) + " requirements")
+
+    # mark everything that was opened while loading
+    for window in sublime.windows():
+        for view in window.views():
+            mark_resources(view)
+
+
+def on_indexes_failed(error):
+    global g_is_loading
+
+    g_is_loading = False
+    sublime.status_message("Spec: " + error)
+
+
+def main(num_retries=0):
+    global g_main_folder
+    global g_is_loading
+
+    if g_main_has_run or g_is_loading:
         return
 
+    # Sublime may still be restoring its windows, so check again for a while;
+    # after that, opening a file in a folder tries again
     if sublime.active_window() is None or len(sublime.active_window().folders()) == 0:
+        if num_retries < c_max_folder_retries:
+            sublime.set_timeout(lambda: main(num_retries + 1), c_folder_retry_ms)
         return
 
     g_main_folder = sublime.active_window().folders()[0]
@@ -763,34 +1291,22 @@ def main():
 
     print "Main folder: " + g_main_folder
 
-    try:
-        spec_file = open(g_main_folder + '/spec.json', 'r')
-    except IOError:
-        print "Could not find spec.json at the root of the project."
-        return
-
-    try:
-        resources_file = open(g_main_folder + '/resources.json', 'r')
-    except IOError:
-        print "Could not find resources.json at the root fo the project."
-        return
-
-    settings = sublime.load_settings(c_base_name)
-    g_spec_path = settings.get("spec_path", "spec")
+    load_settings()
 
-    def set_spec_path(spec_path):
-        global g_spec_path
-        g_spec_path = spec_path
-
-    settings.add_on_change("spec_path", set_spec_path)
+    # parsing the project can take a while, so it happens on a background
+    # thread; until it's done, commands tell the user to wait
+    g_is_loading = True
+    show_loading_progress()
 
-    with spec_file and resources_file:
-        json_spec = json.load(spec_file)
-        json_resources = json.load(resources_file)
-        g_requirements_by_uid = requirements_by_uid(json_spec)
-        g_resources_by_file = resources_by_file(json_resources)
-        g_requirements_by_file = requirements_by_file(json_resources)
-        g_main_has_run = True
+    # the sublime API is only used from the UI thread, so the cache folder
+    # is worked out here rather than in the loading thread
+    main_folder = g_main_folder
+    cache_folder = os.path.join(
+        os.path.dirname(sublime.packages_path()), "Cache", c_cache_folder_name)
+    rebuild_indexes_in_background(lambda: load_indexes(main_folder, cache_folder),
+        on_indexes_loaded, on_indexes_failed)
 
 
-main()
+# The API isn't ready while plugins are being imported, so defer until the
+# editor has finished starting up
+sublime.set_timeout(main, 0)
@@ -0,0 +1,4 @@
+import sys
+from speccore.cli import main
+
+sys.exit(main())
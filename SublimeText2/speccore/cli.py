@@ -0,0 +1,215 @@
+"""
+Runs the plugin's reports without the editor, e.g. on a CI server:
+
+    python -m speccore --project <folder> scope
+    python -m speccore --project <folder> resources --requirement 3
+    python -m speccore --project <folder> slices spec.py:10-20 spec.py:40
+    python -m speccore --project <folder> scan
+    python -m speccore --project <folder> impact master..HEAD
+
+Every command prints the same report as the editor does, or JSON with --json.
+"""
+
+import argparse
+import fileslices
+import gitimpact
+import json
+import multiprocessing
+import sys
+from speccore.transformations import (
+    deprecated_resource, impact_output, indexes_from_json, resource_scan_output,
+    resources_by_requirement, spec_scope, spec_scope_output)
+
+
+def load_project(project_folder):
+    try:
+        spec_file = open(project_folder + '/spec.json', 'r')
+    except IOError:
+        return fileslices.err("Could not find spec.json at the root of the project.")
+
+    try:
+        resources_file = open(project_folder + '/resources.json', 'r')
+    except IOError:
+        spec_file.close()
+        return fileslices.err("Could not find resources.json at the root of the project.")
+
+    with spec_file:
+        with resources_file:
+            try:
+                return fileslices.ok(indexes_from_json(json.load(spec_file), json.load(resources_file)))
+            except (ValueError, KeyError) as error:
+                return fileslices.err("Could not read spec.json and resources.json: " + str(error))
+
+
+# Takes a single tuple so that it can be handed to multiprocessing.Pool.map
+def render_hook(project_folder_hook_and_budgets):
+    project_folder, hook, num_extra_lines, max_lines, max_bytes, max_line_width = \
+        project_folder_hook_and_budgets
+
+    file_slice = fileslices.slice_from_hook(project_folder + '/' + hook, num_extra_lines)
+    if not file_slice.is_ok():
+        return {'hook': hook, 'error': file_slice.err}
+
+    return {
+        'hook': hook,
+        'slice': fileslices.slice_to_string(file_slice.ok, max_lines, max_bytes, max_line_width)
+    }
+
+
+def run_scope(args, indexes):
+    scope = spec_scope(indexes)
+    if args.json:
+        return scope, 0
+
+    return spec_scope_output(scope), 0
+
+
+def run_resources(args, indexes):
+    uids = args.requirement or sorted(indexes.requirements_by_uid.keys())
+
+    if args.json:
+        uids_to_resources = {}
+        for uid in uids:
+            uids_to_resources[uid] = []
+        for file_name, resources in indexes.resources_by_file.iteritems():
+            for resource in resources:
+                if resource['requirementUid'] in uids_to_resources:
+                    resource_in_file = dict(resource)
+                    resource_in_file['file'] = file_name
+                    uids_to_resources[resource['requirementUid']].append(resource_in_file)
+        return uids_to_resources, 0
+
+    listings = []
+    for uid in uids:
+        requirement = indexes.requirements_by_uid.get(uid, deprecated_resource(uid))
+        listings.append(resources_by_requirement(requirement, indexes.resources_by_file))
+    return "\n".join(listings), 0
+
+
+def run_slices(args, indexes):
+    hooks = list(args.hooks)
+    if args.hooks_file == '-':
+        hooks.extend(line.strip() for line in sys.stdin if line.strip())
+    elif args.hooks_file is not None:
+        try:
+            hooks_file = open(args.hooks_file, 'r')
+        except IOError:
+            sys.stderr.write("Could not open the hooks file: " + args.hooks_file + "\n")
+            return None, 2
+
+        with hooks_file:
+            hooks.extend(line.strip() for line in hooks_file if line.strip())
+
+    jobs = [(args.project, hook, args.context, args.max_lines, args.max_bytes, args.max_line_width)
+        for hook in hooks]
+
+    if args.jobs == 1 or len(jobs) <= 1:
+        rendered = map(render_hook, jobs)
+    else:
+        pool = multiprocessing.Pool(args.jobs)
+        try:
+            rendered = pool.map(render_hook, jobs)
+        finally:
+            pool.close()
+            pool.join()
+
+    return_code = 1 if any('error' in result for result in rendered) else 0
+    if args.json:
+        return rendered, return_code
+
+    output = []
+    for result in rendered:
+        output.append(result['hook'])
+        if 'error' in result:
+            output.append(result['error'] + "\n")
+        else:
+            output.append(result['slice'])
+    return "\n".join(output), return_code
+
+
+def run_scan(args, indexes):
+    problems = fileslices.scan_resources(args.project, indexes.resources_by_file, args.jobs)
+    return_code = 1 if len(problems) > 0 else 0
+    if args.json:
+        return problems, return_code
+
+    return resource_scan_output(problems), return_code
+
+
+def run_impact(args, indexes):
+    impact = gitimpact.impact_of_diff(args.project, indexes.resources_by_file, args.commit_range)
+    if not impact.is_ok():
+        sys.stderr.write(impact.err + "\n")
+        return None, 2
+
+    if args.json:
+        return impact.ok, 0
+
+    return impact_output(impact.ok, indexes.requirements_by_uid), 0
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(prog='speccore',
+        description="Spec reports over spec.json and resources.json without the editor.")
+    parser.add_argument('--project', default='.',
+        help="folder holding spec.json and resources.json (default: .)")
+    parser.add_argument('--json', action='store_true',
+        help="print machine-readable JSON instead of the report")
+    parser.add_argument('--jobs', type=int, default=None,
+        help="worker processes for commands that read files (default: one per core)")
+    commands = parser.add_subparsers(dest='command')
+
+    scope = commands.add_parser('scope',
+        help="unaddressed requirements and resources of deleted requirements")
+    scope.set_defaults(run=run_scope)
+
+    resources = commands.add_parser('resources',
+        help="resources linked to each requirement")
+    resources.add_argument('--requirement', type=int, action='append',
+        help="uid of a requirement to list (repeatable; default: all)")
+    resources.set_defaults(run=run_resources)
+
+    slices = commands.add_parser('slices', help="render file hooks as peeked slices")
+    slices.add_argument('hooks', nargs='*',
+        help="hooks in the format <file>:<startline>:<startcol>-<endline>:<endcol>")
+    slices.add_argument('--hooks-file', default=None,
+        help="file with one hook per line, or - for stdin")
+    slices.add_argument('--context', type=int, default=3,
+        help="lines shown around each slice (default: 3)")
+    slices.add_argument('--max-lines', type=int, default=None)
+    slices.add_argument('--max-bytes', type=int, default=None)
+    slices.add_argument('--max-line-width', type=int, default=None)
+    slices.set_defaults(run=run_slices)
+
+    scan = commands.add_parser('scan',
+        help="resources in missing files, past the end of their file, or empty")
+    scan.set_defaults(run=run_scan)
+
+    impact = commands.add_parser('impact',
+        help="requirements touched by uncommitted changes or a commit range")
+    impact.add_argument('commit_range', nargs='?', default=None)
+    impact.set_defaults(run=run_impact)
+
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(sys.argv[1:] if argv is None else argv)
+
+    indexes = load_project(args.project)
+    if not indexes.is_ok():
+        sys.stderr.write(indexes.err + "\n")
+        return 2
+
+    output, return_code = args.run(args, indexes.ok)
+    if output is not None and args.json:
+        json.dump(output, sys.stdout, indent=4)
+        sys.stdout.write("\n")
+    elif output is not None:
+        sys.stdout.write(output)
+
+    return return_code
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,355 @@
+"""
+The pure data transformations behind the Sublime Text plugin. Nothing in here
+touches the editor, so it can be imported by the command line tools as well.
+"""
+
+def deprecated_resource(uid):
+    return {
+        'uid': uid,
+        'name': 'Deprecated',
+        'description': 'Deprecated resource'
+    }
+
+
+def requirements_by_uid(json_requirements):
+    uids_to_requirements = {}
+    for requirement in json_requirements['requirements']:
+        # Note: maybe warn against requirements that have the same uid
+        #       (that should never happen)
+        uids_to_requirements[requirement['uid']] = { 
+            'uid': requirement['uid'],
+            'name': requirement['name'],
+            'description': requirement['description']
+        }
+
+    return uids_to_requirements
+
+
+def resources_by_file(json_resources):
+    files_to_resources = {}
+    for resource in json_resources:
+        # if a list for this file already exists, 
+        # just append a new entry to the list
+        if resource['uri']['file'] not in files_to_resources:
+            files_to_resources[resource['uri']['file']] = []
+
+        files_to_resources[resource['uri']['file']].append({ 
+            'start': resource['uri']['start'],
+            'end': resource['uri']['end'],
+            'requirementUid': resource['requirementUid'],
+            'fingerprint': resource.get('fingerprint')
+        })
+
+    return files_to_resources
+
+
+def requirements_by_file(json_resources):
+    files_to_requirements = {}
+    for resource in json_resources:
+        # if a list for this file already exists,
+        # just append a new entry to the list
+        if resource['uri']['file'] not in files_to_requirements:
+            files_to_requirements[resource['uri']['file']] = set()
+
+        files_to_requirements[resource['uri']['file']].add(resource['requirementUid'])
+
+    return files_to_requirements
+
+
+"""
+An immutable snapshot of everything loaded from spec.json and resources.json.
+
+A snapshot is never changed once it has been built. The with_* methods
+return a new snapshot that shares every index that didn't change, so a
+snapshot can be read from any thread without locking.
+"""
+class Indexes:
+    def __init__(self, _requirements_by_uid=None, _resources_by_file=None, _requirements_by_file=None):
+        self.requirements_by_uid = _requirements_by_uid or {}
+        self.resources_by_file = _resources_by_file or {}
+        self.requirements_by_file = _requirements_by_file or {}
+
+    def with_requirements(self, _requirements_by_uid):
+        return Indexes(_requirements_by_uid, self.resources_by_file, self.requirements_by_file)
+
+    def with_file_resources(self, file_name, resources):
+        _resources_by_file = dict(self.resources_by_file)
+        _resources_by_file[file_name] = resources
+        return Indexes(self.requirements_by_uid, _resources_by_file, self.requirements_by_file)
+
+    def with_requirements_in_file(self, file_name, uids):
+        _requirements_by_file = dict(self.requirements_by_file)
+        _requirements_by_file[file_name] = self.requirements_by_file.get(file_name, set()) | set(uids)
+        return Indexes(self.requirements_by_uid, self.resources_by_file, _requirements_by_file)
+
+    def as_tuple(self):
+        return (self.requirements_by_uid, self.resources_by_file, self.requirements_by_file)
+
+
+def indexes_from_json(json_spec, json_resources):
+    return Indexes(
+        requirements_by_uid(json_spec),
+        resources_by_file(json_resources),
+        requirements_by_file(json_resources))
+
+
+def point(json_dict):
+    return (json_dict['row'], json_dict['col'])
+
+
+# Merges the resources of each requirement in a file that overlap or touch,
+# keeping resources that are really separate as they are. A merged resource
+# covers new text, so its fingerprint is dropped until the file is next saved.
+def coalesce_resources(resources):
+    resources_by_uid = {}
+    for resource in resources:
+        resources_by_uid.setdefault(resource['requirementUid'], []).append(resource)
+
+    retval = []
+    for uid in sorted(resources_by_uid.keys()):
+        sorted_resources = sorted(resources_by_uid[uid],
+            key=lambda resource: (point(resource['start']), point(resource['end'])))
+
+        merged = []
+        for resource in sorted_resources:
+            if len(merged) > 0 and point(resource['start']) <= point(merged[-1]['end']):
+                if point(resource['end']) > point(merged[-1]['end']):
+                    merged[-1] = {
+                        'requirementUid': uid,
+                        'start': merged[-1]['start'],
+                        'end': resource['end'],
+                        'fingerprint': None
+                    }
+            else:
+                merged.append(resource)
+
+        retval.extend(merged)
+
+    return retval
+
+
+def resource_map_to_json(resource_map):
+    json_resources = []
+
+    for file_name, resources in resource_map.iteritems():
+        for resource in resources:
+            json_resource = {
+                'requirementUid': resource['requirementUid'],
+                'uri': {
+                    'file': file_name,
+                    'start': resource['start'],
+                    'end': resource['end']
+                }
+            }
+
+            if resource.get('fingerprint') is not None:
+                json_resource['fingerprint'] = resource['fingerprint']
+
+            json_resources.append(json_resource)
+
+    return json_resources
+
+
+def requirement_string(requirement):
+    return [
+        "requirement " + str(requirement['uid']) + ": " + requirement['name'],
+        requirement['description']
+    ]
+
+
+"""
+NOTE: Technically this is not a pure function (in fact it just does side effects)
+      but it is used as a local mutation inside otherwise pure functions for
+      optimization purposes.
+"""
+def write_spec_output_requirement(c_string_io, requirement):
+    c_string_io.write("\n")
+    c_string_io.write("------------\n")
+    c_string_io.write("requirement #" + str(requirement['uid']) + "\n")
+    c_string_io.write("Name: " + requirement['name'] + "\n")
+    c_string_io.write("Description:\n")
+    c_string_io.write(requirement['description'] + "\n")
+
+
+"""
+NOTE: Technically this is not a pure function (in fact it just does side effects)
+      but it is used as a local mutation inside otherwise pure functions for
+      optimization purposes.
+"""
+def write_spec_output_resource(c_string_io, resource):
+    c_string_io.write(
+        resource['file'] + ":" + 
+        str(resource['start']['row'] + 1) + ":" + 
+        str(resource['start']['col']) + "-" +
+        str(resource['end']['row'] + 1) + ":" + 
+        str(resource['end']['col']) + "\n")
+
+
+# Works out the same scope as "spec scope": requirements that no resource is
+# linked to, and resources linked to a requirement that no longer exists.
+def spec_scope(indexes):
+    addressed_uids = set()
+    resources_not_linked = []
+
+    for file_name, resources in indexes.resources_by_file.iteritems():
+        for resource in resources:
+            addressed_uids.add(resource['requirementUid'])
+            if resource['requirementUid'] not in indexes.requirements_by_uid:
+                resources_not_linked.append({
+                    'requirementUid': resource['requirementUid'],
+                    'uri': {
+                        'file': file_name,
+                        'start': resource['start'],
+                        'end': resource['end']
+                    }
+                })
+
+    requirements_not_addressed = [indexes.requirements_by_uid[uid]
+        for uid in sorted(indexes.requirements_by_uid.keys())
+        if uid not in addressed_uids]
+
+    return {
+        'requirementsNotAddressed': requirements_not_addressed,
+        'resourcesNotLinked': resources_not_linked
+    }
+
+
+def spec_scope_output(spec_scope):
+    from cStringIO import StringIO
+    output = StringIO()
+
+    output.write("Unaddressed requirements\n")
+    output.write("====================\n")
+    for requirement in spec_scope['requirementsNotAddressed']:
+        write_spec_output_requirement(output, requirement)
+
+    output.write("\n\n")
+    output.write("Unassociated (potentially deprecated) resources\n")
+    output.write("===============================================\n")
+    for resource in spec_scope['resourcesNotLinked']:
+        write_spec_output_resource(output, resource['uri'])
+
+    return output.getvalue()
+
+
+def diff_scope_output(diff_scope):
+    from cStringIO import StringIO
+    output = StringIO()
+
+    output.write("New or Unaddressed requirements\n")
+    output.write("===========================\n")
+    for requirement in diff_scope['requirementsToAddress']:
+        write_spec_output_requirement(output, requirement)
+
+    output.write("\n\n")
+    output.write("Resources to Update\n")
+    output.write("===================\n")
+    for resource in diff_scope['resourcesToUpdate']:
+        write_spec_output_resource(output, resource['uri'])
+
+    output.write("\n\n")
+    output.write("Deprecated Resources\n")
+    output.write("====================\n")
+    for resource in diff_scope['deprecatedResources']:
+        write_spec_output_resource(output, resource['uri'])
+
+    return output.getvalue()
+
+
+def resource_scan_output(problems):
+    from cStringIO import StringIO
+    output = StringIO()
+
+    sections = [
+        ('missing-file', "Resources in missing files"),
+        ('out-of-range', "Resources past the end of their file"),
+        ('empty', "Empty resources")
+    ]
+
+    for kind, title in sections:
+        output.write(title + "\n")
+        output.write("=" * len(title) + "\n")
+        for problem in problems:
+            if problem['kind'] == kind:
+                output.write("requirement #" + str(problem['resource']['requirementUid']) + " ")
+                write_spec_output_resource(output, problem['resource'])
+        output.write("\n\n")
+
+    return output.getvalue()
+
+
+def impact_output(uids_to_resources, map_of_all_requirements):
+    from cStringIO import StringIO
+    output = StringIO()
+
+    output.write("Requirements affected by the change\n")
+    output.write("===================================\n")
+
+    for uid in sorted(uids_to_resources.keys()):
+        if uid not in map_of_all_requirements:
+            write_spec_output_requirement(output, deprecated_resource(uid))
+        else:
+            write_spec_output_requirement(output, map_of_all_requirements[uid])
+
+        output.write("\n")
+        output.write("Changed Resources:\n")
+        for resource in uids_to_resources[uid]:
+            write_spec_output_resource(output, resource)
+
+    return output.getvalue()
+
+
+def coverage_output(coverage_by_file, map_of_all_requirements):
+    from cStringIO import StringIO
+    output = StringIO()
+
+    output.write("Coverage by file\n")
+    output.write("================\n")
+
+    lines_by_uid = {}
+    for file_name in sorted(coverage_by_file.keys()):
+        coverage = coverage_by_file[file_name]
+        if coverage['lines']:
+            percent = 100.0 * coverage['covered'] / coverage['lines']
+            output.write("{0:6.1f}% ".format(percent))
+        else:
+            output.write("      ? ")
+
+        output.write(file_name + ": " + str(coverage['covered']) + " of " +
+            str(coverage['lines']) + " lines, " +
+            str(coverage['overlapping']) + " covered more than once\n")
+
+        for uid, lines in coverage['requirements'].iteritems():
+            lines_by_uid[uid] = lines_by_uid.get(uid, 0) + lines
+
+    output.write("\n\n")
+    output.write("Lines by requirement\n")
+    output.write("====================\n")
+    for uid in sorted(lines_by_uid.keys()):
+        if uid not in map_of_all_requirements:
+            requirement = deprecated_resource(uid)
+        else:
+            requirement = map_of_all_requirements[uid]
+
+        output.write("requirement #" + str(uid) + " (" + requirement['name'] + "): " +
+            str(lines_by_uid[uid]) + " lines\n")
+
+    return output.getvalue()
+
+
+def resources_by_requirement(requirement, _resources_by_file):
+    from cStringIO import StringIO
+    output = StringIO()
+
+    write_spec_output_requirement(output, requirement)
+
+    output.write("\n")
+    output.write("Associated Resources:\n")
+
+    for file_name, resources in _resources_by_file.iteritems():
+        for resource in resources:
+            if requirement['uid'] == resource['requirementUid']:
+                resource_in_file = dict(resource)
+                resource_in_file['file'] = file_name
+                write_spec_output_resource(output, resource_in_file)
+    return output.getvalue()